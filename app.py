@@ -1,15 +1,33 @@
+import atexit
+import base64
+import hashlib
 import importlib.util
-import json
+import io
+import mmap
 import os
 import smtplib
-import uuid
+import sqlite3
+import threading
+import time
 import re
-from dataclasses import asdict, dataclass
+import secrets
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from email.message import EmailMessage
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP as SMTP_POLICY
+from functools import lru_cache
+from typing import Iterator
 from pathlib import Path
 
+from celery import Celery
+from celery.signals import worker_process_init
+import orjson
+from diskcache import Cache
 from flask import Flask, abort, redirect, render_template, request, send_file, url_for
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -66,20 +84,33 @@ if os.getenv("FLASK_ENV") != "development":
     validate_env()
 
 BASE_DIR = Path(__file__).resolve().parent
-INVOICES_DIR = BASE_DIR / poster.POSTERS_DIR / "invoices"
-ORDERS_DIR = BASE_DIR / poster.POSTERS_DIR / "orders"
-PREVIEWS_DIR = BASE_DIR / poster.POSTERS_DIR / "previews"
+POSTERS_ROOT = (BASE_DIR / poster.POSTERS_DIR).resolve()
+INVOICES_DIR = POSTERS_ROOT / "invoices"
+ORDERS_DIR = POSTERS_ROOT / "orders"
+PREVIEWS_DIR = POSTERS_ROOT / "previews"
 
 INVOICES_DIR.mkdir(parents=True, exist_ok=True)
 ORDERS_DIR.mkdir(parents=True, exist_ok=True)
 PREVIEWS_DIR.mkdir(parents=True, exist_ok=True)
 
+ORDERS_DB = ORDERS_DIR / "orders.db"
+
+# Geocoding results shared by all web and worker processes
+GEO_CACHE = Cache(str(BASE_DIR / "cache" / "geocode"))
+
 PRICE_CENTS = int(os.getenv("POSTER_PRICE_CENTS", "2900"))
 PRICE_CURRENCY = os.getenv("POSTER_PRICE_CURRENCY", "usd")
+PRICE_CURRENCY_LABEL = PRICE_CURRENCY.upper()
 
 # Input validation constants
-ALLOWED_DISTANCES = range(3000, 40001)  # 3km to 40km
-ALLOWED_DPI = [150, 240, 300]
+MIN_DISTANCE, MAX_DISTANCE = 3000, 40000  # 3km to 40km
+ALLOWED_DPI = frozenset({150, 240, 300})
+EMAIL_RE = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
+PREVIEW_DPI = 150  # Lower DPI for previews (faster, smaller file)
+
+DOWNLOAD_MAX_AGE = 365 * 24 * 60 * 60  # One year; purchased files are immutable
+EXAMPLE_MAX_AGE = 24 * 60 * 60  # Example posters can be swapped in a deploy
 
 stripe = None
 if importlib.util.find_spec("stripe"):
@@ -88,6 +119,18 @@ if importlib.util.find_spec("stripe"):
     stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
 STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID")
+STRIPE_READY = bool(stripe and stripe.api_key and STRIPE_PRICE_ID)
+
+SMTP_CONFIG = {
+    "SMTP_HOST": os.getenv("SMTP_HOST"),
+    "SMTP_PORT": os.getenv("SMTP_PORT", "587"),
+    "SMTP_USER": os.getenv("SMTP_USER"),
+    "SMTP_PASS": os.getenv("SMTP_PASS"),
+    "FROM_EMAIL": os.getenv("FROM_EMAIL"),
+}
+SMTP_CONFIGURED = all(
+    SMTP_CONFIG[key] for key in ("SMTP_HOST", "SMTP_USER", "SMTP_PASS", "FROM_EMAIL")
+)
 
 SIZE_OPTIONS = {
     # Portrait (Vertical)
@@ -140,7 +183,12 @@ EXAMPLE_POSTERS = [
         "size": "18x24",
     },
 ]
-EXAMPLE_POSTER_FILES = {example["filename"] for example in EXAMPLE_POSTERS}
+# Resolved and stat'ed once; missing example files 404 without touching the disk
+EXAMPLE_POSTER_PATHS = {
+    example["filename"]: POSTERS_ROOT / example["filename"]
+    for example in EXAMPLE_POSTERS
+    if (POSTERS_ROOT / example["filename"]).exists()
+}
 
 
 @dataclass
@@ -158,57 +206,222 @@ class Order:
     created_at: str
     paid: bool = False
     coordinates: tuple[float, float] | None = None  # Store coordinates for theme switching
+    status: str = "pending"  # Preview render state: pending, ready or failed
+    price_cents: int = PRICE_CENTS  # Price charged, frozen at order time for the invoice
+    currency: str = PRICE_CURRENCY
+    slug: str = ""  # Filename-safe city name, e.g. "new_york"
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serve JSON responses (webhook acks, request.get_json) through orjson."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Background render queue. Without a broker (local development) tasks run
+# inline so the app still works without Redis/RabbitMQ.
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
+celery = Celery(__name__, broker=CELERY_BROKER_URL)
+celery.conf.task_always_eager = not CELERY_BROKER_URL
 
 # Configure Flask app security
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_COOKIE_SECURE"] = os.getenv("FLASK_ENV") != "development"  # HTTPS only in production
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+# Let a front proxy (Apache mod_xsendfile, nginx) stream files via sendfile(2)
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+# nginx equivalent: an internal location that maps this prefix onto POSTERS_ROOT
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX")
+
+# Compress text responses; PNGs are already compressed and are left alone
+app.config["COMPRESS_MIMETYPES"] = [
+    "text/html",
+    "text/css",
+    "application/json",
+    "application/javascript",
+]
+app.config["COMPRESS_LEVEL"] = 5
+Compress(app)
 
-# Initialize rate limiter
+# Initialize rate limiter. Counters must live in Redis when gunicorn runs
+# several workers, otherwise each worker enforces its own copy of the limit.
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",  # Use Redis in production for persistence
+    storage_uri=os.getenv("LIMITER_REDIS_URI", "memory://"),
+    strategy="fixed-window",  # One counter per key; no sliding-window bookkeeping
 )
 
 
-def stripe_ready() -> bool:
-    return bool(stripe and stripe.api_key and STRIPE_PRICE_ID)
+# Template context for the order form; none of it changes after startup
+INDEX_CONTEXT = {
+    "themes": poster.AVAILABLE_THEMES,
+    "size_options": list(SIZE_OPTIONS.keys()),
+    "stripe_ready": STRIPE_READY,
+    "price_cents": PRICE_CENTS,
+    "price_currency": PRICE_CURRENCY_LABEL,
+    "examples": EXAMPLE_POSTERS,
+}
+
+
+def warm_up_matplotlib() -> None:
+    """Build the font cache and load the Agg backend before the first request."""
+    fig = poster.plt.figure()
+    fig.text(0.5, 0.5, "warm-up", fontproperties=poster.get_font("bold", 12))
+    fig.canvas.draw()
+    poster.plt.close(fig)
+
+
+warm_up_matplotlib()
+
+
+_index_html: str | None = None
 
 
 def render_index(error: str | None = None):
-    return render_template(
-        "index.html",
-        themes=poster.AVAILABLE_THEMES,
-        size_options=SIZE_OPTIONS.keys(),
-        stripe_ready=stripe_ready(),
-        price_cents=PRICE_CENTS,
-        price_currency=PRICE_CURRENCY.upper(),
-        examples=EXAMPLE_POSTERS,
-        error=error,
+    global _index_html
+    if error:
+        return render_template("index.html", **INDEX_CONTEXT, error=error)
+    # Without an error the page only depends on INDEX_CONTEXT, so render it once
+    # (every time in debug mode, so template edits still show up)
+    if _index_html is None or app.debug:
+        _index_html = render_template("index.html", **INDEX_CONTEXT, error=None)
+    return _index_html
+
+
+def cached_coords(city: str, country: str) -> tuple[float, float]:
+    """Geocode ``city, country``, reusing earlier lookups from memory or disk."""
+    return _cached_coords(city.lower().strip(), country.lower().strip())
+
+
+@lru_cache(maxsize=1024)
+def _cached_coords(city: str, country: str) -> tuple[float, float]:
+    key = f"{city}|{country}"
+    if key in GEO_CACHE:
+        return tuple(GEO_CACHE[key])
+    coords = poster.get_coordinates(city, country)
+    if coords:
+        GEO_CACHE[key] = list(coords)
+    return coords
+
+
+_db_local = threading.local()
+
+
+def get_db() -> sqlite3.Connection:
+    """Return this thread's connection to the order database."""
+    conn = getattr(_db_local, "conn", None)
+    # Forked Celery/gunicorn workers must open their own connection
+    if conn is None or _db_local.pid != os.getpid():
+        conn = sqlite3.connect(ORDERS_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL is crash-safe without an fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    return conn
+
+
+def init_db() -> None:
+    get_db().execute(
+        "CREATE TABLE IF NOT EXISTS orders ("
+        "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, paid INTEGER NOT NULL DEFAULT 0)"
     )
 
 
+init_db()
+
+
+# Paid orders no longer change, so repeat reads (success page reloads,
+# downloads) are served from memory. Unpaid orders are always read from the
+# database because the Celery worker and the webhook update them.
+ORDER_CACHE_SIZE = 4096
+_order_cache: OrderedDict[str, Order] = OrderedDict()
+_order_cache_lock = threading.Lock()
+
+
+def _cache_order(order: Order) -> None:
+    with _order_cache_lock:
+        _order_cache[order.session_id] = order
+        _order_cache.move_to_end(order.session_id)
+        if len(_order_cache) > ORDER_CACHE_SIZE:
+            _order_cache.popitem(last=False)
+
+
+def _invalidate_order(session_id: str) -> None:
+    with _order_cache_lock:
+        _order_cache.pop(session_id, None)
+
+
 def save_order(order: Order) -> None:
-    order_path = ORDERS_DIR / f"{order.session_id}.json"
-    order_path.write_text(json.dumps(asdict(order), indent=2), encoding="utf-8")
+    _invalidate_order(order.session_id)
+    get_db().execute(
+        "INSERT OR REPLACE INTO orders (session_id, data, paid) VALUES (?, ?, ?)",
+        (order.session_id, orjson.dumps(order).decode(), int(order.paid)),
+    )
+
+
+def mark_paid(session_id: str, poster_filename: str) -> None:
+    """Flag an order as paid without re-serializing the whole Order."""
+    _invalidate_order(session_id)
+    get_db().execute(
+        "UPDATE orders SET paid = 1, data = json_set(data, '$.paid', json('true'), "
+        "'$.poster_filename', ?) WHERE session_id = ?",
+        (poster_filename, session_id),
+    )
+
+
+def set_order_status(session_id: str, status: str) -> None:
+    """Record the preview render state without rewriting the rest of the order."""
+    _invalidate_order(session_id)
+    get_db().execute(
+        "UPDATE orders SET data = json_set(data, '$.status', ?) WHERE session_id = ?",
+        (status, session_id),
+    )
 
 
 def load_order(session_id: str) -> Order:
+    with _order_cache_lock:
+        cached = _order_cache.get(session_id)
+        if cached is not None:
+            _order_cache.move_to_end(session_id)
+    if cached is not None:
+        # Callers update the order they get back, so never hand out the cached one
+        return replace(cached)
+
+    row = get_db().execute(
+        "SELECT data FROM orders WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    if row is not None:
+        order = Order(**orjson.loads(row[0]))
+        if order.paid:
+            _cache_order(replace(order))
+        return order
+
+    # Orders created before the database existed are still JSON files
     order_path = ORDERS_DIR / f"{session_id}.json"
     if not order_path.exists():
         raise FileNotFoundError
-    data = json.loads(order_path.read_text(encoding="utf-8"))
-    return Order(**data)
+    order = Order(**orjson.loads(order_path.read_bytes()))
+    save_order(order)
+    return order
 
 
-def build_invoice(order: Order) -> None:
-    invoice_path = INVOICES_DIR / order.invoice_filename
+def build_invoice(order: Order) -> bytes:
+    """Return the invoice JSON for ``order``.
+
+    Invoices are derived from the stored order on demand rather than written
+    to disk; INVOICES_DIR only holds invoices of orders placed before that.
+    """
     invoice_data = {
         "invoice_id": order.invoice_filename.replace(".json", ""),
         "created_at": order.created_at,
@@ -218,26 +431,217 @@ def build_invoice(order: Order) -> None:
         "distance_meters": order.distance,
         "size": order.size,
         "dpi": order.dpi,
-        "price_cents": PRICE_CENTS,
-        "currency": PRICE_CURRENCY,
+        "price_cents": order.price_cents,
+        "currency": order.currency,
         "email": order.email or "",
     }
-    invoice_path.write_text(json.dumps(invoice_data, indent=2), encoding="utf-8")
+    return orjson.dumps(invoice_data, option=orjson.OPT_INDENT_2)
 
 
-def send_email(order: Order) -> bool:
-    smtp_host = os.getenv("SMTP_HOST")
-    smtp_port = int(os.getenv("SMTP_PORT", "587"))
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_pass = os.getenv("SMTP_PASS")
-    from_email = os.getenv("FROM_EMAIL")
+def load_invoice(order: Order) -> bytes:
+    legacy_path = INVOICES_DIR / order.invoice_filename
+    if legacy_path.exists():
+        return legacy_path.read_bytes()
+    return build_invoice(order)
+
+
+def render_cache_key(order: Order, theme: str | None = None, preview: bool = False) -> str:
+    """Digest of every input that affects a rendered poster's pixels."""
+    params = {
+        "city": order.city.lower().strip(),
+        "country": order.country.lower().strip(),
+        "theme": theme or order.theme,
+        "dist": order.distance,
+        "size": order.size,
+        "dpi": PREVIEW_DPI if preview else order.dpi,
+    }
+    if preview:
+        params["watermark"] = True
+    encoded = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
 
-    if not all([smtp_host, smtp_user, smtp_pass, from_email, order.email]):
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Yield a temporary sibling of ``path`` and rename it over ``path`` on success.
+
+    Readers see either the previous file or the complete new one, never a
+    partial write, and a failed write leaves no temp file behind.
+    """
+    tmp_name = f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}"
+    tmp_path = path.with_name(tmp_name)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def render_preview(order: Order, theme_name: str) -> Path:
+    """Return the watermarked preview of ``order`` in ``theme_name``, rendering it if needed.
+
+    Previews are keyed by their render inputs rather than by order, so
+    customers choosing the same city, distance, size and theme share one file.
+    """
+    preview_path = PREVIEWS_DIR / f"{render_cache_key(order, theme_name, preview=True)}.png"
+    if preview_path.exists():
+        return preview_path
+
+    # Old orders may lack coordinates
+    coords = order.coordinates or cached_coords(order.city, order.country)
+    with atomic_path(preview_path) as tmp_path:
+        poster.create_poster(
+            city=order.city,
+            country=order.country,
+            point=coords,
+            dist=order.distance,
+            output_file=str(tmp_path),
+            figsize=SIZE_OPTIONS[order.size],
+            dpi=PREVIEW_DPI,
+            watermark=True,
+            theme=poster.load_theme(theme_name),
+        )
+    return preview_path
+
+
+def render_final_poster(order: Order) -> str:
+    """Render the unwatermarked poster for ``order`` and return its filename.
+
+    Final posters are named after render_cache_key, so identical orders
+    share one file and skip matplotlib entirely, and a poster URL always
+    serves the same bytes.
+    """
+    poster_filename = f"{render_cache_key(order)}.png"
+    poster_path = POSTERS_ROOT / poster_filename
+    if poster_path.exists():
+        return poster_filename
+
+    coords = order.coordinates or cached_coords(order.city, order.country)
+    with atomic_path(poster_path) as tmp_path:
+        poster.create_poster(
+            city=order.city,
+            country=order.country,
+            point=coords,
+            dist=order.distance,
+            output_file=str(tmp_path),
+            figsize=SIZE_OPTIONS[order.size],
+            dpi=order.dpi,
+            watermark=False,
+            theme=poster.load_theme(order.theme),
+        )
+    return poster_filename
+
+
+# Runs of characters that can't appear in a download filename
+SLUG_RE = re.compile(r"\W+")
+
+
+def slugify(text: str) -> str:
+    return SLUG_RE.sub("_", text.lower()).strip("_") or "poster"
+
+
+def poster_download_name(order: Order) -> str:
+    """Human-readable filename for the poster attachment and download."""
+    # Orders created before slugs were stored derive one on the fly
+    return f"{order.slug or slugify(order.city)}_{order.theme}.png"
+
+
+class SMTPPool:
+    """Reuse authenticated SMTP connections per thread, keyed by (host, port).
+
+    Connections idle for longer than ``idle_timeout`` seconds, or that fail a
+    NOOP liveness check, are closed and replaced on the next ``get()``.
+    Connections used within the last ``noop_after`` seconds skip the NOOP
+    round trip; callers retry once on ``SMTPServerDisconnected`` instead.
+    """
+
+    def __init__(self, idle_timeout: float = 100.0, noop_after: float = 10.0):
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open: set[smtplib.SMTP] = set()
+
+    def _connections(self) -> dict:
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections
+
+    def get(self, host: str, port: int, user: str, password: str) -> smtplib.SMTP:
+        connections = self._connections()
+        now = time.monotonic()
+        entry = connections.get((host, port))
+        if entry is not None:
+            conn, last_used = entry
+            idle = now - last_used
+            if idle < self.noop_after:
+                connections[(host, port)] = (conn, now)
+                return conn
+            if idle < self.idle_timeout:
+                try:
+                    conn.noop()
+                    connections[(host, port)] = (conn, now)
+                    return conn
+                except (OSError, smtplib.SMTPException):
+                    pass
+            self.discard(host, port)
+
+        conn = smtplib.SMTP(host, port)
+        conn.starttls()
+        conn.login(user, password)
+        connections[(host, port)] = (conn, now)
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def discard(self, host: str, port: int) -> None:
+        entry = self._connections().pop((host, port), None)
+        if entry is not None:
+            self._close(entry[0])
+
+    def _close(self, conn: smtplib.SMTP) -> None:
+        with self._lock:
+            self._open.discard(conn)
+        try:
+            conn.quit()
+        except (OSError, smtplib.SMTPException):
+            conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._open)
+        for conn in connections:
+            self._close(conn)
+
+    def reset(self) -> None:
+        """Forget inherited connections without closing the parent's sockets."""
+        self._local = threading.local()
+        with self._lock:
+            self._open.clear()
+
+
+SMTP_POOL = SMTPPool()
+atexit.register(SMTP_POOL.close_all)
+
+
+@worker_process_init.connect
+def _reset_smtp_pool(**kwargs) -> None:
+    # Prefork workers must not share the SMTP sockets of the parent process
+    SMTP_POOL.reset()
+
+
+def send_email(order: Order) -> bool:
+    if not SMTP_CONFIGURED or not order.email:
         return False
 
-    poster_path = BASE_DIR / poster.POSTERS_DIR / order.poster_filename
-    invoice_path = INVOICES_DIR / order.invoice_filename
-    if not poster_path.exists() or not invoice_path.exists():
+    smtp_host = SMTP_CONFIG["SMTP_HOST"]
+    smtp_port = int(SMTP_CONFIG["SMTP_PORT"])
+    smtp_user = SMTP_CONFIG["SMTP_USER"]
+    smtp_pass = SMTP_CONFIG["SMTP_PASS"]
+    from_email = SMTP_CONFIG["FROM_EMAIL"]
+
+    poster_path = POSTERS_ROOT / order.poster_filename
+    if not poster_path.exists():
         return False
 
     message = EmailMessage()
@@ -249,26 +653,137 @@ def send_email(order: Order) -> bool:
         f"City: {order.city}\nTheme: {order.theme}\nSize: {order.size}\n"
     )
 
-    message.add_attachment(
-        poster_path.read_bytes(),
-        maintype="image",
-        subtype="png",
-        filename=order.poster_filename,
-    )
-    message.add_attachment(
-        invoice_path.read_bytes(),
-        maintype="application",
-        subtype="json",
-        filename=order.invoice_filename,
-    )
+    attachments = [
+        (poster_path, "image/png", poster_download_name(order)),
+        (load_invoice(order), "application/json", order.invoice_filename),
+    ]
 
-    with smtplib.SMTP(smtp_host, smtp_port) as server:
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-        server.send_message(message)
+    server = SMTP_POOL.get(smtp_host, smtp_port, smtp_user, smtp_pass)
+    try:
+        try:
+            send_streamed(server, message, attachments)
+        except smtplib.SMTPServerDisconnected:
+            # The server hung up on a reused connection; reconnect once
+            SMTP_POOL.discard(smtp_host, smtp_port)
+            server = SMTP_POOL.get(smtp_host, smtp_port, smtp_user, smtp_pass)
+            send_streamed(server, message, attachments)
+    except (OSError, smtplib.SMTPException):
+        # Drop the broken connection; the Celery task retries with a fresh one
+        SMTP_POOL.discard(smtp_host, smtp_port)
+        raise
     return True
 
 
+# 57 raw bytes encode to exactly one 76-character base64 line
+ATTACHMENT_CHUNK_SIZE = 57 * 72
+
+
+Attachment = tuple[Path | bytes, str, str]  # (file path or payload, mimetype, filename)
+
+
+@contextmanager
+def attachment_buffer(source: Path | bytes) -> Iterator[memoryview]:
+    """Expose an attachment as a buffer; files are memory-mapped, not read."""
+    if isinstance(source, bytes):
+        yield memoryview(source)
+        return
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # mmap rejects empty files
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+
+
+def iter_mime_message(message: EmailMessage, attachments: list[Attachment]) -> Iterator[bytes]:
+    """Yield ``message`` with attachments base64-encoded chunk by chunk.
+
+    Only one chunk of each file attachment is held in memory at a time,
+    instead of the whole file plus its base64 expansion.
+    """
+    if not message.is_multipart():
+        message.make_mixed()
+    head = message.as_bytes(policy=SMTP_POLICY)
+    boundary = message.get_boundary().encode()
+    closing = b"--" + boundary + b"--"
+    head = head[: head.rindex(closing)]
+    # SMTP transparency: lines starting with "." must be doubled
+    yield re.sub(rb"(?m)^\.", b"..", head)
+
+    for source, mimetype, filename in attachments:
+        part = MIMEPart(policy=SMTP_POLICY)
+        part["Content-Type"] = mimetype
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        yield b"--" + boundary + b"\r\n"
+        yield b"".join(SMTP_POLICY.fold_binary(k, v) for k, v in part.items())
+        yield b"\r\n"
+        with attachment_buffer(source) as data:
+            for start in range(0, len(data), ATTACHMENT_CHUNK_SIZE):
+                with data[start : start + ATTACHMENT_CHUNK_SIZE] as chunk:
+                    encoded = base64.encodebytes(chunk)
+                yield encoded.replace(b"\n", b"\r\n")
+        yield b"\r\n"
+
+    yield closing + b"\r\n"
+
+
+def send_streamed(
+    server: smtplib.SMTP, message: EmailMessage, attachments: list[Attachment]
+) -> None:
+    """Send ``message`` over an open connection, streaming attachments to the socket."""
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(message["From"])
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, message["From"])
+    code, resp = server.rcpt(message["To"])
+    if code not in (250, 251):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused({message["To"]: (code, resp)})
+
+    code, resp = server.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in iter_mime_message(message, attachments):
+        server.send(chunk)
+    server.send(b"\r\n.\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
+
+@celery.task(
+    bind=True,
+    autoretry_for=(OSError, smtplib.SMTPException),
+    retry_backoff=2,
+    max_retries=5,
+)
+def send_email_task(self, session_id: str) -> bool:
+    """Deliver the order email outside the request, retrying SMTP failures."""
+    try:
+        order = load_order(session_id)
+    except FileNotFoundError:
+        # A missing order never comes back, so fail fast instead of retrying
+        print(f"Email not sent: order {session_id} not found")
+        return False
+    return send_email(order)
+
+
+def send_poster_file(path: Path, **kwargs):
+    """``send_file`` for files under POSTERS_ROOT, handing the body to nginx when configured."""
+    response = send_file(path, **kwargs)
+    if X_ACCEL_REDIRECT_PREFIX and response.status_code == 200:
+        # Keep the headers Flask computed; nginx streams the file itself
+        response.close()
+        response.response = []
+        response.headers["X-Accel-Redirect"] = (
+            X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path.relative_to(POSTERS_ROOT).as_posix()
+        )
+    return response
+
+
 @app.get("/")
 def index():
     return render_index()
@@ -276,101 +791,132 @@ def index():
 
 @app.get("/examples/<path:filename>")
 def example_poster(filename: str):
-    if filename not in EXAMPLE_POSTER_FILES:
-        abort(404)
-    poster_path = BASE_DIR / poster.POSTERS_DIR / filename
-    if not poster_path.exists():
+    poster_path = EXAMPLE_POSTER_PATHS.get(filename)
+    if poster_path is None:
         abort(404)
-    return send_file(poster_path, mimetype="image/png")
+    return send_poster_file(
+        poster_path,
+        mimetype="image/png",
+        conditional=True,
+        etag=True,
+        max_age=EXAMPLE_MAX_AGE,
+    )
 
 
-@app.post("/create")
-@limiter.limit("20 per hour")  # Lenient rate limit as requested
-def create():
-    city = request.form.get("city", "").strip()
-    country = request.form.get("country", "").strip()
-    theme = request.form.get("theme", "feature_based")
+@dataclass
+class CreateParams:
+    city: str
+    country: str
+    theme: str
+    distance: int
+    size: str
+    email: str | None
+
+
+def validate_create_form(form) -> tuple[CreateParams | None, str | None]:
+    """Validate the order form, returning (params, None) or (None, error)."""
+    city = form.get("city", "").strip()
+    country = form.get("country", "").strip()
+    theme = form.get("theme", "feature_based")
+    size = form.get("size", "12x16")
+    email = form.get("email", "").strip() or None
+
+    if not city or not country:
+        return None, "City and country are required."
 
     # Validate distance with proper error handling
     try:
-        distance = int(request.form.get("distance", "29000"))
-        if distance not in ALLOWED_DISTANCES:
-            return render_index(error="Distance must be between 3,000 and 40,000 meters.")
+        distance = int(form.get("distance", "29000"))
     except ValueError:
-        return render_index(error="Invalid distance value.")
-
-    # Always use 300 DPI for print-ready quality
-    dpi = 300
-
-    size = request.form.get("size", "12x16")
-    email = request.form.get("email", "").strip() or None
+        return None, "Invalid distance value."
+    if not MIN_DISTANCE <= distance <= MAX_DISTANCE:
+        return None, "Distance must be between 3,000 and 40,000 meters."
 
     # Validate email format if provided
-    if email:
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if not re.match(email_pattern, email):
-            return render_index(error="Invalid email address format.")
-
-    if not city or not country:
-        return render_index(error="City and country are required.")
+    if email and not EMAIL_RE.match(email):
+        return None, "Invalid email address format."
 
     if size not in SIZE_OPTIONS:
-        return render_index(error="Unsupported size selection.")
+        return None, "Unsupported size selection."
 
-    # Validate theme
     if theme not in poster.AVAILABLE_THEMES:
-        return render_index(error="Invalid theme selected.")
+        return None, "Invalid theme selected."
 
-    coords = poster.get_coordinates(city, country)
+    return CreateParams(city, country, theme, distance, size, email), None
+
+
+@app.post("/create")
+@limiter.limit("20 per hour")  # Lenient rate limit as requested
+def create():
+    params, error = validate_create_form(request.form)
+    if error:
+        return render_index(error=error)
+
+    # Only hit the geocoder once the form is known to be valid
+    coords = cached_coords(params.city, params.country)
     if coords is None:
         return render_index(
             error="We could not find that city. Please double-check the spelling."
         )
 
-    # Create preview with watermark
-    preview_id = uuid.uuid4().hex
-    preview_filename = f"preview_{preview_id}_{theme}.png"
-    preview_path = PREVIEWS_DIR / preview_filename
-
-    # Generate lower-res preview (faster, smaller file)
-    preview_dpi = 150
-    poster.THEME = poster.load_theme(theme)
-    poster.create_poster(
-        city=city,
-        country=country,
-        point=coords,
-        dist=distance,
-        output_file=str(preview_path),
-        figsize=SIZE_OPTIONS[size],
-        dpi=preview_dpi,
-        watermark=True,
-    )
-
-    invoice_id = preview_id
+    invoice_id = secrets.token_hex(16)
     invoice_filename = f"{invoice_id}.json"
     order = Order(
         session_id=invoice_id,
-        city=city,
-        country=country,
-        theme=theme,
-        distance=distance,
-        size=size,
-        dpi=dpi,
-        email=email,
+        city=params.city,
+        country=params.country,
+        theme=params.theme,
+        distance=params.distance,
+        size=params.size,
+        dpi=300,  # Always use 300 DPI for print-ready quality
+        email=params.email,
         poster_filename="",  # Will be generated after purchase
         invoice_filename=invoice_filename,
         created_at=datetime.now(timezone.utc).isoformat(),
         paid=False,
         coordinates=coords,
+        status="pending",
+        slug=slugify(params.city),
     )
     save_order(order)
-    build_invoice(order)
 
-    # Redirect to preview page
-    return redirect(url_for("preview", session_id=order.session_id))
+    # Render the preview in the worker pool and let the client poll for it
+    render_poster.delay(order.session_id)
+    return redirect(url_for("status", session_id=order.session_id))
+
+
+@celery.task
+def render_poster(session_id: str) -> None:
+    """Render the watermarked preview for a pending order."""
+    order = load_order(session_id)
+    try:
+        render_preview(order, order.theme)
+    except Exception:
+        set_order_status(session_id, "failed")
+        raise
+
+    # Only touch the status: /purchase or the webhook may have updated the
+    # order while it rendered
+    set_order_status(session_id, "ready")
+
+
+@app.get("/status/<session_id>")
+@limiter.exempt  # status.html reloads itself every few seconds until the render finishes
+def status(session_id: str):
+    try:
+        order = load_order(session_id)
+    except FileNotFoundError:
+        abort(404)
+
+    if order.status == "ready":
+        return redirect(url_for("preview", session_id=order.session_id))
+    if order.status == "failed":
+        return render_index(error="We could not generate your poster. Please try again.")
+    return render_template("status.html", order=order)
 
 
 @app.get("/success")
+@limiter.exempt  # processing.html reloads itself until the webhook has finished
 def success():
     # Use order_id instead of session_id (preserves our internal UUID)
     order_id = request.args.get("order_id")
@@ -387,45 +933,27 @@ def success():
         # Webhook hasn't processed yet - show processing message
         return render_template("processing.html", order=order)
 
+    # The Stripe webhook already rendered the poster and queued the email,
+    # so reloading this page is a plain read with no outbound calls.
+    email_sent = bool(order.email) and SMTP_CONFIGURED
+
     # If no poster filename, it means payment wasn't through Stripe (dev mode)
     if not order.poster_filename:
         # Generate poster for non-Stripe orders
-        if order.coordinates is None:
-            coords = poster.get_coordinates(order.city, order.country)
-        else:
-            coords = order.coordinates
-
-        poster_filename = (
-            f"{order.city.lower().replace(' ', '_')}_{order.theme}_"
-            f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        )
-        poster_path = BASE_DIR / poster.POSTERS_DIR / poster_filename
-
-        poster.THEME = poster.load_theme(order.theme)
-        poster.create_poster(
-            city=order.city,
-            country=order.country,
-            point=coords,
-            dist=order.distance,
-            output_file=str(poster_path),
-            figsize=SIZE_OPTIONS[order.size],
-            dpi=order.dpi,
-            watermark=False,
-        )
-
-        order.poster_filename = poster_filename
+        order.poster_filename = render_final_poster(order)
         order.paid = True
-        save_order(order)
+        mark_paid(order.session_id, order.poster_filename)
 
-    email_sent = False
-    if order.email and not os.getenv("EMAIL_SENT_FLAG"):
-        email_sent = send_email(order)
+        email_sent = False
+        if order.email and SMTP_CONFIGURED and not os.getenv("EMAIL_SENT_FLAG"):
+            send_email_task.delay(order.session_id)
+            email_sent = True
 
     return render_template(
         "result.html",
         order=order,
         email_sent=email_sent,
-        stripe_ready=stripe_ready(),
+        stripe_ready=STRIPE_READY,
     )
 
 
@@ -440,9 +968,9 @@ def preview(session_id: str):
         "preview.html",
         order=order,
         themes=poster.AVAILABLE_THEMES,
-        stripe_ready=stripe_ready(),
+        stripe_ready=STRIPE_READY,
         price_cents=PRICE_CENTS,
-        price_currency=PRICE_CURRENCY.upper(),
+        price_currency=PRICE_CURRENCY_LABEL,
     )
 
 
@@ -457,31 +985,14 @@ def preview_image(session_id: str, theme_name: str):
     if theme_name not in poster.AVAILABLE_THEMES:
         abort(400)
 
-    # Check if preview already exists for this theme
-    preview_filename = f"preview_{session_id}_{theme_name}.png"
-    preview_path = PREVIEWS_DIR / preview_filename
-
-    if not preview_path.exists():
-        # Generate preview for this theme
-        if order.coordinates is None:
-            # Fallback: get coordinates again
-            coords = poster.get_coordinates(order.city, order.country)
-        else:
-            coords = order.coordinates
-
-        poster.THEME = poster.load_theme(theme_name)
-        poster.create_poster(
-            city=order.city,
-            country=order.country,
-            point=coords,
-            dist=order.distance,
-            output_file=str(preview_path),
-            figsize=SIZE_OPTIONS[order.size],
-            dpi=150,  # Lower DPI for previews
-            watermark=True,
-        )
-
-    return send_file(preview_path, mimetype="image/png")
+    # Preview files are keyed by their render inputs, so they never change
+    return send_poster_file(
+        render_preview(order, theme_name),
+        mimetype="image/png",
+        conditional=True,
+        etag=True,
+        max_age=DOWNLOAD_MAX_AGE,
+    )
 
 
 @app.post("/purchase/<session_id>")
@@ -492,13 +1003,19 @@ def purchase(session_id: str):
     except FileNotFoundError:
         abort(404)
 
+    # Paid orders are final; don't start a second checkout or change the theme
+    if order.paid:
+        return redirect(url_for("success", order_id=order.session_id))
+
     # Update theme if user changed it
     selected_theme = request.form.get("theme", order.theme)
+    if selected_theme not in poster.AVAILABLE_THEMES:
+        abort(400)
     if selected_theme != order.theme:
         order.theme = selected_theme
         save_order(order)
 
-    if stripe_ready():
+    if STRIPE_READY:
         session = stripe.checkout.Session.create(
             mode="payment",
             line_items=[{"price": STRIPE_PRICE_ID, "quantity": 1}],
@@ -520,43 +1037,51 @@ def generate_final(session_id: str):
     except FileNotFoundError:
         abort(404)
 
-    # Generate final high-res poster without watermark
-    if order.coordinates is None:
-        coords = poster.get_coordinates(order.city, order.country)
-    else:
-        coords = order.coordinates
-
-    poster_filename = (
-        f"{order.city.lower().replace(' ', '_')}_{order.theme}_"
-        f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-    )
-    poster_path = BASE_DIR / poster.POSTERS_DIR / poster_filename
-
-    poster.THEME = poster.load_theme(order.theme)
-    poster.create_poster(
-        city=order.city,
-        country=order.country,
-        point=coords,
-        dist=order.distance,
-        output_file=str(poster_path),
-        figsize=SIZE_OPTIONS[order.size],
-        dpi=order.dpi,
-        watermark=False,  # No watermark for purchased version
-    )
+    # Already finished (reload or second visit): show it without re-rendering
+    if order.paid:
+        return render_template(
+            "result.html",
+            order=order,
+            email_sent=False,
+            stripe_ready=STRIPE_READY,
+        )
 
-    order.poster_filename = poster_filename
+    # Generate final high-res poster without watermark
+    order.poster_filename = render_final_poster(order)
     order.paid = True
-    save_order(order)
+    mark_paid(order.session_id, order.poster_filename)
 
-    email_sent = send_email(order) if order.email else False
+    email_sent = False
+    if order.email and SMTP_CONFIGURED:
+        send_email_task.delay(order.session_id)
+        email_sent = True
     return render_template(
         "result.html",
         order=order,
         email_sent=email_sent,
-        stripe_ready=stripe_ready(),
+        stripe_ready=STRIPE_READY,
     )
 
 
+@celery.task
+def finalize_order(session_id: str) -> None:
+    """Render the paid poster and email it once Stripe confirms payment."""
+    order = load_order(session_id)
+    if order.paid:
+        return  # Stripe redelivered the event after we already finished
+
+    # Generate final high-res poster without watermark
+    order.poster_filename = render_final_poster(order)
+    mark_paid(session_id, order.poster_filename)
+
+    # Send email if provided
+    if order.email and SMTP_CONFIGURED:
+        send_email_task.delay(session_id)
+        print(f"Email queued to {order.email} for order {session_id}")
+
+    print(f"Order {session_id} completed successfully")
+
+
 @app.post("/webhook/stripe")
 def stripe_webhook():
     """Handle Stripe webhook events for payment confirmation"""
@@ -597,47 +1122,10 @@ def stripe_webhook():
             print(f"Warning: Order {order_id} not found for Stripe session {session['id']}")
             return {"status": "ignored"}, 200
 
-        # Mark as paid and generate final poster
+        # Render in the worker so Stripe gets its 200 before it times out
         if not order.paid:
             print(f"Processing payment for order {order_id}")
-            order.paid = True
-
-            # Generate final high-res poster without watermark
-            if order.coordinates is None:
-                coords = poster.get_coordinates(order.city, order.country)
-            else:
-                coords = order.coordinates
-
-            poster_filename = (
-                f"{order.city.lower().replace(' ', '_')}_{order.theme}_"
-                f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            )
-            poster_path = BASE_DIR / poster.POSTERS_DIR / poster_filename
-
-            poster.THEME = poster.load_theme(order.theme)
-            poster.create_poster(
-                city=order.city,
-                country=order.country,
-                point=coords,
-                dist=order.distance,
-                output_file=str(poster_path),
-                figsize=SIZE_OPTIONS[order.size],
-                dpi=order.dpi,
-                watermark=False,  # No watermark for paid version
-            )
-
-            order.poster_filename = poster_filename
-            save_order(order)
-
-            # Send email if provided
-            if order.email:
-                try:
-                    send_email(order)
-                    print(f"Email sent to {order.email} for order {order_id}")
-                except Exception as e:
-                    print(f"Failed to send email for order {order_id}: {e}")
-
-            print(f"Order {order_id} completed successfully")
+            finalize_order.delay(order_id)
 
     return {"status": "success"}, 200
 
@@ -658,12 +1146,28 @@ def download(session_id: str, filename: str):
     if not order.paid:
         abort(403)
 
-    poster_path = BASE_DIR / poster.POSTERS_DIR / order.poster_filename
-    invoice_path = INVOICES_DIR / order.invoice_filename
+    poster_path = POSTERS_ROOT / order.poster_filename
     if filename == order.poster_filename and poster_path.exists():
-        return send_file(poster_path, as_attachment=True)
-    if filename == order.invoice_filename and invoice_path.exists():
-        return send_file(invoice_path, as_attachment=True)
+        # Purchased files never change, so let browsers revalidate with 304s
+        return send_poster_file(
+            poster_path,
+            as_attachment=True,
+            download_name=poster_download_name(order),
+            conditional=True,
+            etag=True,
+            max_age=DOWNLOAD_MAX_AGE,
+        )
+    if filename == order.invoice_filename:
+        invoice = load_invoice(order)
+        return send_file(
+            io.BytesIO(invoice),
+            mimetype="application/json",
+            as_attachment=True,
+            download_name=order.invoice_filename,
+            conditional=True,
+            etag=hashlib.blake2b(invoice, digest_size=16).hexdigest(),
+            max_age=DOWNLOAD_MAX_AGE,
+        )
     abort(404)
 
 
@@ -673,9 +1177,9 @@ if __name__ == "__main__":
 
     if is_dev:
         print("Running in DEVELOPMENT mode")
-        app.run(debug=True, host="127.0.0.1", port=8000)
+        app.run(debug=True, host="127.0.0.1", port=8000, threaded=True)
     else:
         print("ERROR: Do not run app.py directly in production!")
-        print("Use: gunicorn -w 4 -b 0.0.0.0:8000 app:app")
+        print("Use: gunicorn -c gunicorn.conf.py app:app")
         print("Or deploy to a platform like Railway/Heroku with Procfile")
         exit(1)
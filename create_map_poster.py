@@ -1,21 +1,35 @@
 import os
+import csv
 import json
-import time
+import pickle
+import hashlib
+import threading
 import argparse
+import multiprocessing
 from datetime import datetime
-from functools import lru_cache
+from functools import lru_cache, wraps
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import osmnx as ox
 import numpy as np
 from geopy.geocoders import Nominatim
+from geopy.extra.rate_limiter import RateLimiter
 from tqdm import tqdm
 
 import matplotlib
 matplotlib.use("Agg", force=True)
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.font_manager import FontProperties
 import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.path import Path
+from matplotlib.patches import PathPatch
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D, ScaledTranslation
+import shapely
+from PIL import Image
 
 # Optimize matplotlib for low memory
 plt.ioff()  # Turn off interactive mode
@@ -27,9 +41,11 @@ APP_UA = os.getenv("OSM_USER_AGENT", "CityMapPoster/1.0 (contact: bo.hamilton09@
 ox.settings.http_headers = {"User-Agent": APP_UA}
 ox.settings.use_cache = True
 ox.settings.cache_folder = "./cache"
-ox.settings.memory_only_mode = True  # Don't write graphs to disk
 ox.settings.log_console = False  # Reduce logging overhead
 
+# Parsed OSM layers, so repeat renders of an area skip Overpass and graph building
+LAYER_CACHE_DIR = os.path.join(ox.settings.cache_folder, "layers")
+
 THEMES_DIR = "themes"
 FONTS_DIR = "fonts"
 POSTERS_DIR = "posters"
@@ -61,7 +77,37 @@ def load_fonts():
 
 FONTS = load_fonts()
 
-def generate_output_filename(city, theme_name):
+@lru_cache(maxsize=None)
+def get_font(weight, size):
+    """
+    Shared FontProperties for a Roboto weight ('bold', 'regular', 'light') and size.
+    Cached so repeated renders reuse the same font objects and lookups.
+    """
+    if FONTS:
+        return FontProperties(fname=FONTS[weight], size=size)
+    # Fallback to system fonts
+    return FontProperties(family='monospace', weight='bold' if weight == 'bold' else 'normal', size=size)
+
+@lru_cache(maxsize=None)
+def _text_path(text, weight, size):
+    """Glyph outlines of text (in points), laid out once and shared by every render."""
+    return TextPath((0, 0), text, prop=get_font(weight, size))
+
+def add_static_text(ax, x, y, text, weight, size, ha='center', va='center', rotation=0, **kwargs):
+    """
+    Draw text that is the same on every poster (attribution, watermark) as a
+    PathPatch of its cached outline, so FreeType doesn't lay it out again per render.
+    x, y are axes coordinates; ha/va align the ink bounds. kwargs go to PathPatch.
+    """
+    path = _text_path(text, weight, size)
+    ext = path.get_extents()
+    dx = {'left': ext.x0, 'center': (ext.x0 + ext.x1) / 2, 'right': ext.x1}[ha]
+    dy = {'bottom': ext.y0, 'center': (ext.y0 + ext.y1) / 2, 'top': ext.y1}[va]
+    transform = (Affine2D().translate(-dx, -dy).rotate_deg(rotation).scale(1 / 72)
+                 + ax.figure.dpi_scale_trans + ScaledTranslation(x, y, ax.transAxes))
+    ax.add_patch(PathPatch(path, transform=transform, edgecolor='none', **kwargs))
+
+def generate_output_filename(city, theme_name, fmt='png'):
     """
     Generate unique output filename with city, theme, and datetime.
     """
@@ -70,7 +116,7 @@ def generate_output_filename(city, theme_name):
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     city_slug = city.lower().replace(' ', '_')
-    filename = f"{city_slug}_{theme_name}_{timestamp}.png"
+    filename = f"{city_slug}_{theme_name}_{timestamp}.{fmt}"
     return os.path.join(POSTERS_DIR, filename)
 
 def get_available_themes():
@@ -90,14 +136,24 @@ def get_available_themes():
 
 AVAILABLE_THEMES = get_available_themes()
 
-@lru_cache(maxsize=32)
+def _read_theme(theme_name):
+    """Parse a theme JSON file and precompute its road color table."""
+    with open(os.path.join(THEMES_DIR, f"{theme_name}.json"), 'r') as f:
+        theme = json.load(f)
+    try:
+        theme['_road_rgba'] = road_rgba(theme)
+    except (KeyError, ValueError):
+        pass  # Incomplete theme; colors are resolved (and fail) at render time
+    return theme
+
 def load_theme(theme_name="feature_based"):
     """
-    Load theme from JSON file in themes directory.
+    Return a theme from the themes directory, preloaded at import.
+    Themes are shared, so treat the returned dict as read-only.
     """
-    theme_file = os.path.join(THEMES_DIR, f"{theme_name}.json")
-    
-    if not os.path.exists(theme_file):
+    theme = _ALL_THEMES.get(theme_name)
+    if theme is None:
+        theme_file = os.path.join(THEMES_DIR, f"{theme_name}.json")
         print(f"⚠ Theme file '{theme_file}' not found. Using default feature_based theme.")
         # Fallback to embedded default theme
         return {
@@ -114,40 +170,50 @@ def load_theme(theme_name="feature_based"):
             "road_residential": "#4A4A4A",
             "road_default": "#3A3A3A"
         }
-    
-    with open(theme_file, 'r') as f:
-        theme = json.load(f)
-        print(f"✓ Loaded theme: {theme.get('name', theme_name)}")
-        if 'description' in theme:
-            print(f"  {theme['description']}")
-        return theme
+
+    return theme
 
 # Load theme (can be changed via command line or input)
 THEME = None  # Will be loaded later
 
+# Per-thread theme override, so concurrent renders never see each other's theme
+_theme_local = threading.local()
+
+def set_theme(theme):
+    """Set the theme used by renders on the current thread."""
+    _theme_local.theme = theme
+
+def current_theme():
+    """Return this thread's theme, falling back to THEME and then the default theme."""
+    return getattr(_theme_local, 'theme', None) or THEME or load_theme()
+
+@lru_cache(maxsize=64)
+def _gradient_image(color, location):
+    """Read-only (256, 1, 4) alpha ramp in color, opaque at the poster edge; shared by every render."""
+    # Draw the alpha ramp as an RGBA image directly; no colormap to build.
+    # uint8 lets matplotlib resample it without full-size float64 buffers.
+    alpha = np.linspace(1, 0, 256) if location == 'bottom' else np.linspace(0, 1, 256)
+    gradient = np.empty((256, 1, 4), dtype=np.uint8)
+    gradient[..., :3] = np.round(np.array(mcolors.to_rgb(color)) * 255)
+    gradient[:, 0, 3] = np.round(alpha * 255)
+    gradient.flags.writeable = False
+    return gradient
+
 def create_gradient_fade(ax, color, location='bottom', zorder=10):
     """
     Creates a fade effect at the top or bottom of the map.
+    A fully transparent color (e.g. "none") turns the fade off.
     """
-    vals = np.linspace(0, 1, 256).reshape(-1, 1)
-    gradient = np.hstack((vals, vals))
-    
-    rgb = mcolors.to_rgb(color)
-    my_colors = np.zeros((256, 4))
-    my_colors[:, 0] = rgb[0]
-    my_colors[:, 1] = rgb[1]
-    my_colors[:, 2] = rgb[2]
-    
+    if mcolors.to_rgba(color)[3] == 0:
+        return
+
+    gradient = _gradient_image(color, location)
     if location == 'bottom':
-        my_colors[:, 3] = np.linspace(1, 0, 256)
         extent_y_start = 0
         extent_y_end = 0.25
     else:
-        my_colors[:, 3] = np.linspace(0, 1, 256)
         extent_y_start = 0.75
         extent_y_end = 1.0
-
-    custom_cmap = mcolors.ListedColormap(my_colors)
     
     xlim = ax.get_xlim()
     ylim = ax.get_ylim()
@@ -156,53 +222,175 @@ def create_gradient_fade(ax, color, location='bottom', zorder=10):
     y_bottom = ylim[0] + y_range * extent_y_start
     y_top = ylim[0] + y_range * extent_y_end
     
-    ax.imshow(gradient, extent=[xlim[0], xlim[1], y_bottom, y_top], 
-              aspect='auto', cmap=custom_cmap, zorder=zorder, origin='lower')
+    ax.imshow(gradient, extent=[xlim[0], xlim[1], y_bottom, y_top],
+              aspect='auto', zorder=zorder, origin='lower')
+
+# Road hierarchy: theme color key and line width per class, thickest first
+ROAD_CLASSES = ('road_motorway', 'road_primary', 'road_secondary',
+                'road_tertiary', 'road_residential', 'road_default')
+ROAD_WIDTHS = np.array([1.2, 1.0, 0.8, 0.6, 0.4, 0.4], dtype=np.float32)
+_DEFAULT_ROAD_CLASS = ROAD_CLASSES.index('road_default')
+
+# OSM highway tag -> index into ROAD_CLASSES
+HIGHWAY_CLASS = {
+    'motorway': 0, 'motorway_link': 0,
+    'trunk': 1, 'trunk_link': 1, 'primary': 1, 'primary_link': 1,
+    'secondary': 2, 'secondary_link': 2,
+    'tertiary': 3, 'tertiary_link': 3,
+    'residential': 4, 'living_street': 4, 'unclassified': 4,
+}
+
+def _highway_class(highway):
+    # Handle list of highway types (take the first one)
+    if isinstance(highway, list):
+        highway = highway[0] if highway else 'unclassified'
+    return HIGHWAY_CLASS.get(highway, _DEFAULT_ROAD_CLASS)
 
-def get_edge_colors_and_widths_by_type(G):
+def road_rgba(theme):
+    """RGBA table for the theme's road colors, one float32 row per ROAD_CLASSES entry."""
+    return np.array([mcolors.to_rgba(theme[key]) for key in ROAD_CLASSES], dtype=np.float32)
+
+# Every theme, parsed once at import so renders (and batch runs) never reopen JSON
+_ALL_THEMES = {name: _read_theme(name) for name in AVAILABLE_THEMES}
+
+def road_class_ids(G):
+    """
+    ROAD_CLASSES index (uint8) of every edge, in G.edges order.
+    Each edge is classified with one dict lookup. The result is kept on
+    G.graph, so restyling the same graph with another theme is just a gather.
+    """
+    class_ids = G.graph.get('_road_class_ids')
+    if class_ids is not None and len(class_ids) == G.number_of_edges():
+        return class_ids
+
+    lookup = HIGHWAY_CLASS.get
+    class_ids = np.array([
+        lookup(highway, _DEFAULT_ROAD_CLASS) if type(highway) is str else _highway_class(highway)
+        for _, _, highway in G.edges(data='highway', default='unclassified')
+    ], dtype=np.uint8)
+    G.graph['_road_class_ids'] = class_ids
+    return class_ids
+
+def get_edge_colors_and_widths_by_type(G, theme=None):
     """
     Assigns colors and widths to edges based on road type hierarchy.
-    Returns tuple of (colors, widths) corresponding to each edge in the graph.
-    Combined single-pass iteration for better performance.
-    """
-    edge_colors = []
-    edge_widths = []
-
-    for u, v, data in G.edges(data=True):
-        # Get the highway type (can be a list or string)
-        highway = data.get('highway', 'unclassified')
-
-        # Handle list of highway types (take the first one)
-        if isinstance(highway, list):
-            highway = highway[0] if highway else 'unclassified'
-
-        # Assign color and width based on road type (single pass)
-        if highway in ['motorway', 'motorway_link']:
-            color = THEME['road_motorway']
-            width = 1.2
-        elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
-            color = THEME['road_primary']
-            width = 1.0
-        elif highway in ['secondary', 'secondary_link']:
-            color = THEME['road_secondary']
-            width = 0.8
-        elif highway in ['tertiary', 'tertiary_link']:
-            color = THEME['road_tertiary']
-            width = 0.6
-        elif highway in ['residential', 'living_street', 'unclassified']:
-            color = THEME['road_residential']
-            width = 0.4
-        else:
-            color = THEME['road_default']
-            width = 0.4
-
-        edge_colors.append(color)
-        edge_widths.append(width)
+    Returns tuple of (colors, widths) arrays corresponding to each edge in the graph:
+    an (N, 4) RGBA array and an (N,) width array, both float32.
+    Colors and widths are gathered from per-class tables by road_class_ids(G),
+    so theme colors are parsed once per render instead of once per edge.
+    """
+    theme = theme or current_theme()
+    class_ids = road_class_ids(G)
+    palette = theme.get('_road_rgba')
+    if palette is None:
+        palette = road_rgba(theme)
+    return palette[class_ids], ROAD_WIDTHS[class_ids]
+
+def _edge_segments(G):
+    """
+    Vertex arrays for every edge, in G.edges order. Edges without a geometry
+    are straight lines between their end nodes, as in ox.graph_to_gdfs.
+    Node coordinates are gathered into one array and curved edges are unpacked
+    with a single shapely call, instead of building a small array per edge.
+    """
+    node_index = {node: i for i, node in enumerate(G.nodes)}
+    xy = np.array([(x, y) for (_, x), (_, y) in zip(G.nodes(data='x'), G.nodes(data='y'))])
+
+    ends = []
+    curved_at = []
+    curved = []
+    for i, (u, v, geometry) in enumerate(G.edges(data='geometry')):
+        ends.append((node_index[u], node_index[v]))
+        if geometry is not None:
+            curved_at.append(i)
+            curved.append(geometry)
+
+    # (N, 2, 2) straight segments; views into it are valid LineCollection segments
+    segments = list(xy[np.array(ends, dtype=np.intp).reshape(-1, 2)])
+    if curved:
+        curved = np.array(curved, dtype=object)
+        splits = np.cumsum(shapely.get_num_coordinates(curved))[:-1]
+        for i, vertices in zip(curved_at, np.split(shapely.get_coordinates(curved), splits)):
+            segments[i] = vertices
+    return segments
+
+def map_extent(segments):
+    """Visible map area as (left, bottom, right, top): edge bounds plus 2% padding, as ox.plot_graph frames the map."""
+    vertices = np.concatenate(segments)
+    left, bottom = vertices.min(axis=0)
+    right, top = vertices.max(axis=0)
+    pad_ns = (top - bottom) * 0.02
+    pad_ew = (right - left) * 0.02
+    return left - pad_ew, bottom - pad_ns, right + pad_ew, top + pad_ns
+
+def plot_roads(ax, G, edge_colors, edge_widths, segments=None):
+    """
+    Draw the street network as one LineCollection and frame the axes around it.
+    Matches ox.plot_graph without building a GeoDataFrame of edge geometries or
+    drawing the whole canvas an extra time.
+    Pass segments if _edge_segments(G) was already computed.
+    """
+    if segments is None:
+        segments = _edge_segments(G)
+    # rasterized only matters for vector output (PDF/SVG); text stays vector there
+    roads = LineCollection(segments, colors=edge_colors, linewidths=edge_widths,
+                           zorder=1, rasterized=True)
+    ax.add_collection(roads, autolim=False)
+
+    left, bottom, right, top = map_extent(segments)
+    ax.set_ylim((bottom, top))
+    ax.set_xlim((left, right))
+
+    ax.margins(0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+
+    if ox.projection.is_projected(G.graph['crs']):
+        ax.set_aspect('equal')
+    else:
+        # Unprojected lat/lon: correct the aspect so the map isn't stretched
+        ax.set_aspect(1 / np.cos(np.deg2rad((bottom + top) / 2)))
 
-    return edge_colors, edge_widths
+def _polygon_paths(features, clip_box=None, tolerance=0):
+    """
+    One compound Path per polygon in features (MultiPolygons exploded), with
+    interior rings kept as holes. Points and lines are skipped.
+    Geometry is first clipped to clip_box (xmin, ymin, xmax, ymax) and simplified
+    with tolerance, so off-canvas and sub-pixel vertices never reach Agg.
+    """
+    geoms = features.geometry.to_numpy()
+    if clip_box is not None:
+        geoms = shapely.clip_by_rect(geoms, *clip_box)
+    if tolerance:
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=False)
+    parts = shapely.get_parts(geoms)
+    parts = parts[(shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)]
+    # Normalized rings wind holes against their exterior (so they stay unfilled),
+    # and match the vertex order GeoDataFrame.plot draws
+    polygons = shapely.normalize(parts)
+    paths = []
+    for polygon in polygons:
+        rings = [polygon.exterior, *polygon.interiors]
+        paths.append(Path.make_compound_path(
+            *[Path(np.asarray(ring.coords)[:, :2], closed=True) for ring in rings]))
+    return paths
+
+def plot_polygons(ax, features, color, zorder, clip_box=None, tolerance=0):
+    """
+    Fill every polygon in features with color as a single PathCollection,
+    instead of the per-geometry patch objects GeoDataFrame.plot builds.
+    """
+    paths = _polygon_paths(features, clip_box, tolerance)
+    if not paths:
+        return
+    ax.add_collection(PathCollection(paths, facecolors=color, edgecolors='none',
+                                     zorder=zorder, rasterized=True), autolim=False)
 
 # Global geocoder instance (reused across requests)
 _geolocator = None
+_geocode = None
 
 def _get_geolocator():
     """Get or create the singleton Nominatim geolocator instance."""
@@ -211,17 +399,48 @@ def _get_geolocator():
         _geolocator = Nominatim(user_agent="CityMapPoster/1.0 (contact: bo.hamilton09@gmail.com)")
     return _geolocator
 
-# Cache for geocoding results (key: "city, country")
+def _get_geocode():
+    """Rate-limited geocode function: at most one Nominatim call per second, with retries."""
+    global _geocode
+    if _geocode is None:
+        _geocode = RateLimiter(_get_geolocator().geocode, min_delay_seconds=1.0,
+                               max_retries=2, swallow_exceptions=False)
+    return _geocode
+
+# Cache for geocoding results (key: "city, country"). In memory by default; the
+# CLI persists it to GEOCODE_CACHE_PATH across runs via use_geocode_cache_file().
+# Servers importing this module keep their own shared cache instead.
+GEOCODE_CACHE_PATH = os.path.join(ox.settings.cache_folder, "geocode.json")
+_geocode_lock = threading.Lock()
 _geocode_cache = {}
-_last_geocode_time = 0
+_persist_geocodes = False
+
+def _load_geocode_cache():
+    try:
+        with open(GEOCODE_CACHE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_geocode_cache():
+    os.makedirs(os.path.dirname(GEOCODE_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{GEOCODE_CACHE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(_geocode_cache, f)
+    os.replace(tmp_path, GEOCODE_CACHE_PATH)
+
+def use_geocode_cache_file():
+    """Load earlier lookups from GEOCODE_CACHE_PATH and save new ones back to it (single-process CLI use)."""
+    global _persist_geocodes
+    with _geocode_lock:
+        _geocode_cache.update(_load_geocode_cache())
+        _persist_geocodes = True
 
 def get_coordinates(city, country):
     """
     Fetches coordinates for a given city and country using geopy.
     Includes caching and rate limiting to be respectful to the geocoding service.
     """
-    global _last_geocode_time
-
     cache_key = f"{city.lower()}, {country.lower()}"
 
     # Check cache first
@@ -233,47 +452,132 @@ def get_coordinates(city, country):
         return (lat, lon)
 
     print("Looking up coordinates...")
-    geolocator = _get_geolocator()
-
-    # Rate limiting: ensure at least 1 second between API calls
-    elapsed = time.time() - _last_geocode_time
-    if elapsed < 1.0:
-        time.sleep(1.0 - elapsed)
-
-    location = geolocator.geocode(f"{city}, {country}")
-    _last_geocode_time = time.time()
+    location = _get_geocode()(f"{city}, {country}")
 
     if location:
         print(f"✓ Found: {location.address}")
         print(f"✓ Coordinates: {location.latitude}, {location.longitude}")
 
         # Cache the result
-        _geocode_cache[cache_key] = (location.latitude, location.longitude, location.address)
+        with _geocode_lock:
+            _geocode_cache[cache_key] = [location.latitude, location.longitude, location.address]
+            if _persist_geocodes:
+                _save_geocode_cache()
 
         return (location.latitude, location.longitude)
     else:
         raise ValueError(f"Could not find coordinates for {city}, {country}")
 
 
+def _layer_cache(layer):
+    """
+    Cache a fetcher's result on disk, keyed by layer, point and distance.
+    Failed fetches (None) are not cached.
+    """
+    def decorator(fetch):
+        @wraps(fetch)
+        def wrapper(point, dist):
+            lat, lon = point
+            key = hashlib.blake2b(f"{layer}|{lat:.4f}|{lon:.4f}|{dist}".encode(), digest_size=16).hexdigest()
+            path = os.path.join(LAYER_CACHE_DIR, f"{key}.pkl")
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+                print(f"✓ Using cached {layer}")
+                return result
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+            result = fetch(point, dist)
+            if result is not None:
+                os.makedirs(LAYER_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            return result
+        return wrapper
+    return decorator
+
+@_layer_cache('streets')
 def _fetch_street_network(point, dist):
-    """Fetch street network data from OSM."""
-    return ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all')
-
-def _fetch_water_features(point, dist):
-    """Fetch water features from OSM."""
+    """Fetch street network data from OSM, with road classes precomputed for the layer cache."""
+    G = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all')
+    road_class_ids(G)
+    return G
+
+# OSM tags for the two polygon layers, fetched together in one Overpass query
+WATER_TAGS = {'natural': 'water', 'waterway': 'riverbank'}
+PARK_TAGS = {'leisure': 'park', 'landuse': 'grass'}
+
+@_layer_cache('water+parks')
+def _fetch_polygon_features(point, dist):
+    """Fetch water features and parks/green spaces from OSM in a single query."""
     try:
-        return ox.features_from_point(point, tags={'natural': 'water', 'waterway': 'riverbank'}, dist=dist)
+        return ox.features_from_point(point, tags={**WATER_TAGS, **PARK_TAGS}, dist=dist)
     except:
         return None
 
-def _fetch_parks(point, dist):
-    """Fetch parks and green spaces from OSM."""
-    try:
-        return ox.features_from_point(point, tags={'leisure': 'park', 'landuse': 'grass'}, dist=dist)
-    except:
+def _select_tags(features, tags):
+    """Rows of features matching any of the given tag key/value pairs."""
+    if features is None:
         return None
+    mask = np.zeros(len(features), dtype=bool)
+    for key, value in tags.items():
+        if key in features.columns:
+            mask |= (features[key] == value).to_numpy()
+    return features[mask]
+
+# Pillow encoder settings per output format. Posters are mostly flat color, so
+# zlib level 1 barely grows the PNG but encodes several times faster than level 6.
+SAVE_OPTIONS = {
+    'png': {'optimize': False, 'compress_level': 1},
+    'webp': {'lossless': True, 'method': 0, 'quality': 100},
+}
 
-def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi=300, watermark=False):
+def _save_options(output_file):
+    """Pillow encoder settings for output_file, picked by its extension."""
+    ext = os.path.splitext(output_file)[1].lstrip('.').lower()
+    return SAVE_OPTIONS.get(ext, SAVE_OPTIONS['png'])
+
+def _write_image(rgba, size, output_file, dpi):
+    """Encode a rendered RGBA buffer to output_file."""
+    image = Image.frombuffer('RGBA', size, rgba, 'raw', 'RGBA', 0, 1)
+    image.save(output_file, dpi=(dpi, dpi), **_save_options(output_file))
+
+# Per-thread figure reused across renders of the same size (CLI and batch only),
+# so they skip figure setup and keep the Agg canvas buffer instead of reallocating it
+_figure_local = threading.local()
+
+def _get_figure(figsize, facecolor, reuse=False):
+    """
+    Return a cleared poster Figure and a full-bleed Axes.
+    With reuse, the Figure (and its canvas buffer, hundreds of MB at print size)
+    is kept on this thread for the next render; otherwise it's a fresh one that
+    is freed once the caller drops it.
+    """
+    fig = getattr(_figure_local, 'figure', None) if reuse else None
+    if fig is None or tuple(fig.get_size_inches()) != tuple(figsize):
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        if reuse:
+            _figure_local.figure = fig
+    else:
+        fig.clear()
+        fig.set_dpi(matplotlib.rcParams['figure.dpi'])
+    fig.set_facecolor(facecolor)
+    ax = fig.add_axes([0, 0, 1, 1])
+    return fig, ax
+
+def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi=300, watermark=False,
+                  theme=None, reuse_figure=False):
+    """
+    Render a poster to output_file.
+    Pass theme explicitly from concurrent callers; it defaults to current_theme().
+    reuse_figure keeps this thread's figure and canvas buffer for the next render;
+    use it from single-threaded batch loops, not from long-lived multi-threaded servers.
+    """
+    theme = theme or current_theme()
     print(f"\nGenerating map for {city}, {country}...")
 
     # Parallel data fetching with ThreadPoolExecutor
@@ -282,30 +586,27 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
     water = None
     parks = None
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
+    with ThreadPoolExecutor(max_workers=2) as executor:
         # Submit all tasks concurrently
         future_streets = executor.submit(_fetch_street_network, point, dist)
-        future_water = executor.submit(_fetch_water_features, point, dist)
-        future_parks = executor.submit(_fetch_parks, point, dist)
+        future_polygons = executor.submit(_fetch_polygon_features, point, dist)
 
         # Progress bar for completion tracking
         futures = {
             'Street network': future_streets,
-            'Water features': future_water,
-            'Parks/green spaces': future_parks
+            'Water features and parks': future_polygons,
         }
 
-        with tqdm(total=3, desc="Downloading", unit="layer", bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}') as pbar:
+        with tqdm(total=2, desc="Downloading", unit="layer", bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}') as pbar:
             for name, future in futures.items():
                 pbar.set_description(f"Downloading {name}")
                 result = future.result()  # Wait for completion
 
                 if name == 'Street network':
                     G = result
-                elif name == 'Water features':
-                    water = result
-                elif name == 'Parks/green spaces':
-                    parks = result
+                else:
+                    water = _select_tags(result, WATER_TAGS)
+                    parks = _select_tags(result, PARK_TAGS)
 
                 pbar.update(1)
 
@@ -313,32 +614,36 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
     
     # 2. Setup Plot
     print("Rendering map...")
-    fig, ax = plt.subplots(figsize=figsize, facecolor=THEME['bg'])
-    ax.set_facecolor(THEME['bg'])
-    ax.set_position([0, 0, 1, 1])
+    fig, ax = _get_figure(figsize, theme['bg'], reuse=reuse_figure)
+    ax.set_facecolor(theme['bg'])
     
     # 3. Plot Layers
+    # The map frame follows the streets; polygons are cut down to it (plus a few
+    # pixels, so edge antialiasing is unchanged) and simplified to a quarter pixel
+    segments = _edge_segments(G)
+    left, bottom, right, top = map_extent(segments)
+    pixel = min((right - left) / (figsize[0] * dpi), (top - bottom) / (figsize[1] * dpi))
+    margin = 4 * pixel
+    clip_box = (left - margin, bottom - margin, right + margin, top + margin)
+
     # Layer 1: Polygons
     if water is not None and not water.empty:
-        water.plot(ax=ax, facecolor=THEME['water'], edgecolor='none', zorder=1)
+        plot_polygons(ax, water, theme['water'], zorder=1, clip_box=clip_box, tolerance=pixel / 4)
     if parks is not None and not parks.empty:
-        parks.plot(ax=ax, facecolor=THEME['parks'], edgecolor='none', zorder=2)
+        plot_polygons(ax, parks, theme['parks'], zorder=2, clip_box=clip_box, tolerance=pixel / 4)
     
     # Layer 2: Roads with hierarchy coloring
     print("Applying road hierarchy colors...")
-    edge_colors, edge_widths = get_edge_colors_and_widths_by_type(G)
-    
-    ox.plot_graph(
-        G, ax=ax, bgcolor=THEME['bg'],
-        node_size=0,
-        edge_color=edge_colors,
-        edge_linewidth=edge_widths,
-        show=False, close=False
-    )
+    edge_colors, edge_widths = get_edge_colors_and_widths_by_type(G, theme)
     
+    plot_roads(ax, G, edge_colors, edge_widths, segments)
+    # Posters stretch the map over the whole page rather than keeping plot_roads'
+    # geographic aspect (which would shrink the axes to a centred box)
+    ax.set_aspect('auto')
+
     # Layer 3: Gradients (Top and Bottom)
-    create_gradient_fade(ax, THEME['gradient_color'], location='bottom', zorder=10)
-    create_gradient_fade(ax, THEME['gradient_color'], location='top', zorder=10)
+    create_gradient_fade(ax, theme['gradient_color'], location='bottom', zorder=10)
+    create_gradient_fade(ax, theme['gradient_color'], location='top', zorder=10)
     
     # 4. Typography using Roboto font with responsive sizing
     city_upper = city.upper()
@@ -362,15 +667,9 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
         base_size = 28
         city_spacing = ""
 
-    if FONTS:
-        font_main = FontProperties(fname=FONTS['bold'], size=base_size)
-        font_sub = FontProperties(fname=FONTS['light'], size=22)
-        font_coords = FontProperties(fname=FONTS['regular'], size=14)
-    else:
-        # Fallback to system fonts
-        font_main = FontProperties(family='monospace', weight='bold', size=base_size)
-        font_sub = FontProperties(family='monospace', weight='normal', size=22)
-        font_coords = FontProperties(family='monospace', size=14)
+    font_main = get_font('bold', base_size)
+    font_sub = get_font('light', 22)
+    font_coords = get_font('regular', 14)
 
     # Handle very long city names by wrapping
     if city_length > 20:
@@ -397,9 +696,9 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
 
         # Draw two lines
         ax.text(0.5, 0.15, line1, transform=ax.transAxes,
-                color=THEME['text'], ha='center', fontproperties=font_main, zorder=11)
+                color=theme['text'], ha='center', fontproperties=font_main, zorder=11)
         ax.text(0.5, 0.12, line2, transform=ax.transAxes,
-                color=THEME['text'], ha='center', fontproperties=font_main, zorder=11)
+                color=theme['text'], ha='center', fontproperties=font_main, zorder=11)
         country_y = 0.09
         coords_y = 0.06
         line_y = 0.105
@@ -407,14 +706,14 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
         # Single line with spacing
         spaced_city = city_spacing.join(list(city_upper))
         ax.text(0.5, 0.14, spaced_city, transform=ax.transAxes,
-                color=THEME['text'], ha='center', fontproperties=font_main, zorder=11)
+                color=theme['text'], ha='center', fontproperties=font_main, zorder=11)
         country_y = 0.10
         coords_y = 0.07
         line_y = 0.125
 
     # --- BOTTOM TEXT ---
     ax.text(0.5, country_y, country.upper(), transform=ax.transAxes,
-            color=THEME['text'], ha='center', fontproperties=font_sub, zorder=11)
+            color=theme['text'], ha='center', fontproperties=font_sub, zorder=11)
     
     lat, lon = point
     coords = f"{lat:.4f}° N / {lon:.4f}° E" if lat >= 0 else f"{abs(lat):.4f}° S / {lon:.4f}° E"
@@ -422,44 +721,36 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
         coords = coords.replace("E", "W")
 
     ax.text(0.5, coords_y, coords, transform=ax.transAxes,
-            color=THEME['text'], alpha=0.7, ha='center', fontproperties=font_coords, zorder=11)
+            color=theme['text'], alpha=0.7, ha='center', fontproperties=font_coords, zorder=11)
 
     ax.plot([0.4, 0.6], [line_y, line_y], transform=ax.transAxes,
-            color=THEME['text'], linewidth=1, zorder=11)
+            color=theme['text'], linewidth=1, zorder=11)
 
     # --- ATTRIBUTION (bottom right) ---
-    if FONTS:
-        font_attr = FontProperties(fname=FONTS['light'], size=8)
-    else:
-        font_attr = FontProperties(family='monospace', size=8)
-    
-    ax.text(0.98, 0.02, "© OpenStreetMap contributors", transform=ax.transAxes,
-            color=THEME['text'], alpha=0.5, ha='right', va='bottom',
-            fontproperties=font_attr, zorder=11)
+    add_static_text(ax, 0.98, 0.02, "© OpenStreetMap contributors", 'light', 8,
+                    ha='right', va='bottom', facecolor=theme['text'], alpha=0.5, zorder=11)
 
     # Add watermark if requested (for preview mode)
     if watermark:
-        if FONTS:
-            watermark_font = FontProperties(fname=FONTS['bold'], size=72)
-        else:
-            watermark_font = FontProperties(family='monospace', weight='bold', size=72)
-
         # Calculate watermark color (inverse of background for visibility)
-        bg_rgb = mcolors.to_rgb(THEME['bg'])
+        bg_rgb = mcolors.to_rgb(theme['bg'])
         # Use text color with low opacity for subtle watermark
-        watermark_color = THEME['text']
+        watermark_color = theme['text']
 
         # Add diagonal watermark across the center
-        ax.text(0.5, 0.5, 'PREVIEW', transform=ax.transAxes,
-                color=watermark_color, alpha=0.15, ha='center', va='center',
-                fontproperties=watermark_font, zorder=12, rotation=45)
+        add_static_text(ax, 0.5, 0.5, 'PREVIEW', 'bold', 72, rotation=45,
+                        facecolor=watermark_color, alpha=0.15, zorder=12)
 
-    # 5. Save with optimized PNG compression
+    # 5. Save with fast compression settings for the output format.
+    # The axes already fill the figure, so there is no bbox_inches='tight' pass:
+    # rasterize once at the output DPI and hand the pixels straight to Pillow.
     print(f"Saving to {output_file}...")
-    plt.savefig(output_file, dpi=dpi, facecolor=THEME['bg'],
-                bbox_inches='tight', pad_inches=0,
-                pil_kwargs={'optimize': True, 'compress_level': 6})
-    plt.close('all')
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    size = fig.canvas.get_width_height(physical=True)
+    _write_image(fig.canvas.buffer_rgba(), size, output_file, dpi)
+    # Drop this render's artists; a reused figure is kept for the next poster
+    fig.clear()
 
     # Force garbage collection to free memory
     import gc
@@ -467,6 +758,67 @@ def create_poster(city, country, point, dist, output_file, figsize=(12, 16), dpi
 
     print(f"✓ Done! Poster saved as {output_file}")
 
+def read_batch(path, defaults):
+    """
+    Read poster jobs from a CSV file with a header row. city and country are
+    required; theme, size and distance columns are optional and fall back to defaults.
+    """
+    jobs = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            job = dict(defaults)
+            job.update({key: value.strip() for key, value in row.items()
+                        if key in ('city', 'country', 'theme', 'size', 'distance') and value and value.strip()})
+            if not job.get('city') or not job.get('country'):
+                raise ValueError(f"{path}:{line}: city and country are required")
+            if job['theme'] not in AVAILABLE_THEMES:
+                raise ValueError(f"{path}:{line}: unknown theme '{job['theme']}'")
+            if job['size'] not in POSTER_SIZES:
+                raise ValueError(f"{path}:{line}: unknown size '{job['size']}'")
+            job['distance'] = int(job['distance'])
+            jobs.append(job)
+    return jobs
+
+def _render_batch_job(job):
+    """Pool worker: render one geocoded batch job. Returns (job, output_file, error)."""
+    output_file = job['output_file']
+    try:
+        create_poster(job['city'], job['country'], job['coords'], job['distance'], output_file,
+                      POSTER_SIZES[job['size']]["inches"], theme=load_theme(job['theme']),
+                      reuse_figure=True)
+        return job, output_file, None
+    except Exception as e:
+        return job, None, str(e)
+
+def run_batch(jobs, processes=None):
+    """
+    Render jobs in parallel, one poster per worker process at a time.
+    Geocoding happens here first, in one process, so the Nominatim rate limit
+    (and the geocode cache file) isn't shared by several workers. Workers are
+    spawned rather than forked so none inherits this process's matplotlib state.
+    Returns the number of failed posters.
+    """
+    runnable = []
+    for number, job in enumerate(jobs, start=1):
+        # Name every poster here: parallel jobs start within the same second, so
+        # the timestamp alone would let two rows overwrite each other's file
+        root, ext = os.path.splitext(generate_output_filename(job['city'], job['theme'], job['format']))
+        try:
+            runnable.append({**job, 'output_file': f"{root}_{number:03d}{ext}",
+                             'coords': get_coordinates(job['city'], job['country'])})
+        except Exception as e:
+            print(f"✗ {job['city']}, {job['country']}: {e}")
+    failed = len(jobs) - len(runnable)
+
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        for job, output_file, error in pool.imap_unordered(_render_batch_job, runnable):
+            if error:
+                failed += 1
+                print(f"✗ {job['city']}, {job['country']}: {error}")
+            else:
+                print(f"✓ {job['city']}, {job['country']} → {output_file}")
+    return failed
+
 def print_examples():
     """Print usage examples."""
     print("""
@@ -513,6 +865,7 @@ Options:
   --theme, -t       Theme name (default: feature_based)
   --size, -s        Poster size: small, medium, large, xl (default: medium)
   --distance, -d    Map radius in meters (default: 29000)
+  --format, -f      Output format: png, webp (default: png)
   --list-themes     List all available themes
 
 Distance guide:
@@ -532,7 +885,7 @@ Generated posters are saved to 'posters/' directory.
 
 def list_themes():
     """List all available themes with descriptions."""
-    available_themes = get_available_themes()
+    available_themes = AVAILABLE_THEMES
     if not available_themes:
         print("No themes found in 'themes/' directory.")
         return
@@ -540,15 +893,9 @@ def list_themes():
     print("\nAvailable Themes:")
     print("-" * 60)
     for theme_name in available_themes:
-        theme_path = os.path.join(THEMES_DIR, f"{theme_name}.json")
-        try:
-            with open(theme_path, 'r') as f:
-                theme_data = json.load(f)
-                display_name = theme_data.get('name', theme_name)
-                description = theme_data.get('description', '')
-        except:
-            display_name = theme_name
-            description = ''
+        theme_data = _ALL_THEMES[theme_name]
+        display_name = theme_data.get('name', theme_name)
+        description = theme_data.get('description', '')
         print(f"  {theme_name}")
         print(f"    {display_name}")
         if description:
@@ -564,6 +911,7 @@ Examples:
   python create_map_poster.py --city "New York" --country "USA"
   python create_map_poster.py --city Tokyo --country Japan --theme midnight_blue
   python create_map_poster.py --city Paris --country France --theme noir --distance 15000
+  python create_map_poster.py --batch cities.csv --jobs 4
   python create_map_poster.py --list-themes
         """
     )
@@ -579,7 +927,13 @@ Examples:
         choices=sorted(POSTER_SIZES.keys()),
         help='Poster size (default: medium)'
     )
+    parser.add_argument('--format', '-f', type=str, default='png', choices=sorted(SAVE_OPTIONS),
+                        help='Output format; webp is lossless and smaller (default: png)')
     parser.add_argument('--distance', '-d', type=int, default=29000, help='Map radius in meters (default: 29000)')
+    parser.add_argument('--batch', '-b', type=str, metavar='CSV',
+                        help='Render every row of a CSV file (columns: city,country[,theme,size,distance])')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Worker processes for --batch (default: CPU count)')
     parser.add_argument('--list-themes', action='store_true', help='List all available themes')
     
     args = parser.parse_args()
@@ -593,7 +947,26 @@ Examples:
     if args.list_themes:
         list_themes()
         os.sys.exit(0)
-    
+
+    use_geocode_cache_file()
+
+    if args.batch:
+        defaults = {'theme': args.theme, 'size': args.size, 'distance': args.distance, 'format': args.format}
+        try:
+            jobs = read_batch(args.batch, defaults)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            os.sys.exit(1)
+
+        print("=" * 50)
+        print(f"City Map Poster Generator: {len(jobs)} posters")
+        print("=" * 50)
+        failed = run_batch(jobs, args.jobs)
+        print("\n" + "=" * 50)
+        print(f"✓ {len(jobs) - failed} of {len(jobs)} posters generated")
+        print("=" * 50)
+        os.sys.exit(1 if failed else 0)
+
     # Validate required arguments
     if not args.city or not args.country:
         print("Error: --city and --country are required.\n")
@@ -601,7 +974,7 @@ Examples:
         os.sys.exit(1)
     
     # Validate theme exists
-    available_themes = get_available_themes()
+    available_themes = AVAILABLE_THEMES
     if args.theme not in available_themes:
         print(f"Error: Theme '{args.theme}' not found.")
         print(f"Available themes: {', '.join(available_themes)}")
@@ -611,14 +984,19 @@ Examples:
     print("City Map Poster Generator")
     print("=" * 50)
     
-    # Load theme
-    THEME = load_theme(args.theme)
+    # Load theme for this (main) thread's renders
+    theme = load_theme(args.theme)
+    set_theme(theme)
+    print(f"✓ Loaded theme: {theme.get('name', args.theme)}")
+    if 'description' in theme:
+        print(f"  {theme['description']}")
     
     # Get coordinates and generate poster
     try:
         coords = get_coordinates(args.city, args.country)
-        output_file = generate_output_filename(args.city, args.theme)
-        create_poster(args.city, args.country, coords, args.distance, output_file, args.size)
+        output_file = generate_output_filename(args.city, args.theme, args.format)
+        figsize = POSTER_SIZES[args.size]["inches"]
+        create_poster(args.city, args.country, coords, args.distance, output_file, figsize)
         
         print("\n" + "=" * 50)
         print("✓ Poster generation complete!")
@@ -0,0 +1,23 @@
+import os
+
+# Gunicorn settings for the web app: gunicorn -c gunicorn.conf.py app:app
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# A 300 DPI render in the request takes hundreds of MB, so default to one
+# worker with a spare thread for light requests. os.cpu_count() would report
+# the host's CPUs inside a container; raise WEB_CONCURRENCY/GUNICORN_THREADS
+# only where the memory is there for it.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+
+# Final high-res renders still run in the request, so keep a long timeout
+timeout = 300
+
+# Recycle workers regularly to release matplotlib memory
+max_requests = 10
+max_requests_jitter = 5
+
+# Serve send_file() responses with sendfile(2) so poster bytes go from the
+# page cache to the socket without passing through Python
+sendfile = True